@@ -1,208 +1,1018 @@
-# add at top with others
-from bs4 import BeautifulSoup
+import asyncio
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, quote_plus, urlencode, urlsplit
+
+import diskcache
+import httpx
+from google.cloud import firestore
+from playwright.async_api import TimeoutError as PWTimeout
+from playwright.async_api import async_playwright
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:  # selectolax not installed – fall back to BeautifulSoup
+    LexborHTMLParser = None
+    import soupsieve as sv
+    from bs4 import BeautifulSoup, SoupStrainer
+
+REGIONS = [r.strip() for r in os.getenv("REGIONS", "ZA-WC-CT").split(",") if r.strip()]
+# one or more of SEARCHERS' keys, comma-separated; all share one run
+STORES = [s.strip().upper() for s in os.getenv("STORE", "CHECKERS").split(",") if s.strip()]
+# normalised + de-duped (order kept): "Beef  Mince" and "beef mince " are one item
+INGREDIENTS = list(dict.fromkeys(
+    " ".join(i.split()).lower() for i in json.loads(os.getenv("INGREDIENTS_JSON", "[]"))
+    if isinstance(i, str) and i.strip()
+))
+CONCURRENCY = int(os.getenv("SCRAPER_CONCURRENCY", "4"))
+PAUSE_MS = int(os.getenv("PAUSE_MS", "0"))  # optional min gap between request starts
+POOL_MIN = int(os.getenv("SCRAPER_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("SCRAPER_POOL_MAX", "3"))
+POOL_IDLE_S = float(os.getenv("SCRAPER_POOL_IDLE_S", "60"))
+POOL_PAGES = int(os.getenv("SCRAPER_POOL_PAGES", "8"))  # tabs per browser
+STATE_DIR = os.getenv("SCRAPER_STATE_DIR", ".playwright-state")
+CACHE_DIR = os.getenv("SCRAPER_CACHE_DIR", ".price_cache")
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_H", "6")) * 3600
+FORCE_REFRESH = os.getenv("FORCE_REFRESH") == "1"
+
+# ---------- browser pool ----------
+class BrowserPool:
+    """Warm Chromium instances shared by all searches.
+
+    Each page() opens a tab on the least-busy browser, inside a context that
+    browser keeps per key (site) for the whole run, so cookies, cache and
+    connections carry over between ingredients. A new browser is only
+    launched when every pooled one already has `max_pages` tabs open and
+    we're below `max`. Browsers idle longer than `idle_timeout` are closed
+    down to `min`.
+    """
+
+    PING_AFTER_S = 10.0  # re-check a browser with about:blank after this much idle
+
+    def __init__(self):
+        self._pw = None
+        self._load: dict = {}        # browser -> open pages
+        self._idle_since: dict = {}  # browser -> loop time it went idle
+        self._contexts: dict = {}    # (browser, key) -> shared context
+        self._lock = asyncio.Lock()
+        self._ctx_lock = asyncio.Lock()
+        self.min, self.max, self.idle_timeout, self.max_pages = 1, 3, 60.0, 8
+
+    async def init(self, pw, min: int = 1, max: int = 3, idle_timeout: float = 60.0,
+                   max_pages: int = 8):
+        self._pw = pw
+        self.min, self.max, self.idle_timeout = min, max, idle_timeout
+        self.max_pages = max_pages
+        for _ in range(min):
+            b = await self._launch()
+            self._load[b] = 0
+            self._idle_since[b] = self._now()
+
+    @contextlib.asynccontextmanager
+    async def page(self, key: str, setup=None, **context_opts):
+        """Yield a new page in `key`'s shared context.
+
+        `context_opts` and the async `setup(ctx)` hook only apply when that
+        context is first created on a browser.
+        """
+        browser = await self._checkout()
+        page = None
+        try:
+            ctx = await self._context(browser, key, setup, context_opts)
+            page = await ctx.new_page()
+            yield page
+        finally:
+            if page is not None:
+                with contextlib.suppress(Exception):
+                    await page.close()
+                    # a discarded context goes once its last page is done
+                    if ctx not in self._contexts.values() and not ctx.pages:
+                        await ctx.close()
+            await self.release(browser)
+
+    async def discard(self, ctx) -> None:
+        """Stop handing out `ctx`; the next page() for its key gets a new one."""
+        async with self._ctx_lock:
+            for k in [k for k, c in self._contexts.items() if c is ctx]:
+                del self._contexts[k]
+
+    async def _context(self, browser, key: str, setup, context_opts: dict):
+        async with self._ctx_lock:
+            ctx = self._contexts.get((browser, key))
+            if ctx is None:
+                ctx = await browser.new_context(**context_opts)
+                if setup is not None:
+                    await setup(ctx)
+                self._contexts[(browser, key)] = ctx
+            return ctx
+
+    async def release(self, browser) -> None:
+        async with self._lock:
+            if browser not in self._load:
+                return
+            self._load[browser] -= 1
+            if self._load[browser] == 0:
+                self._idle_since[browser] = self._now()
+            await self._evict_idle()
+
+    async def drain(self) -> None:
+        async with self._lock:
+            browsers = list(self._load)
+            self._load.clear()
+            self._idle_since.clear()
+            self._contexts.clear()
+        for b in browsers:
+            await self._close(b)
+
+    async def _checkout(self):
+        while True:
+            async with self._lock:
+                roomy = [b for b, n in self._load.items() if n < self.max_pages]
+                if roomy:
+                    b = min(roomy, key=self._load.get)
+                elif len(self._load) < self.max:
+                    b = await self._launch()
+                    self._load[b] = 0
+                else:
+                    b = min(self._load, key=self._load.get)
+                # claimed before the health check, so nobody else pings it
+                self._load[b] += 1
+                idle_since = self._idle_since.pop(b, None)
+            # outside the lock: a ping can take seconds
+            if await self._healthy(b, idle_since):
+                return b
+            async with self._lock:
+                self._forget(b)
+            await self._close(b)
+
+    async def _healthy(self, browser, idle_since: float | None) -> bool:
+        if not browser.is_connected():
+            return False
+        if idle_since is None or self._now() - idle_since < self.PING_AFTER_S:
+            return True
+        try:
+            page = await browser.new_page()
+            await page.goto("about:blank", timeout=5000)
+            await page.close()
+            return True
+        except Exception:
+            return False
+
+    async def _evict_idle(self) -> None:
+        now = self._now()
+        stale = [b for b, t in self._idle_since.items() if now - t > self.idle_timeout]
+        for b in stale:
+            if len(self._load) <= self.min:
+                break
+            self._forget(b)
+            await self._close(b)
+
+    def _forget(self, browser) -> None:
+        self._load.pop(browser, None)
+        self._idle_since.pop(browser, None)
+        for k in [k for k in self._contexts if k[0] is browser]:
+            del self._contexts[k]
+
+    async def _launch(self):
+        return await self._pw.chromium.launch(headless=True)
+
+    @staticmethod
+    async def _close(browser) -> None:
+        try:
+            await browser.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _now() -> float:
+        return asyncio.get_running_loop().time()
+
+# ---------- request blocking ----------
+# Only the product-card DOM matters; img alt/src come from markup, not bytes.
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media", "stylesheet"}
+BLOCKED_HOSTS = ("google-analytics", "googletagmanager", "doubleclick",
+                 "facebook", "hotjar", "segment.com", "segment.io")
+
+async def _route_filter(route) -> None:
+    req = route.request
+    if (req.resource_type in BLOCKED_RESOURCE_TYPES
+            or any(h in req.url for h in BLOCKED_HOSTS)):
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def _setup_context(ctx) -> None:
+    await ctx.route("**/*", _route_filter)
+
+# ---------- HTML parsing (selectolax/Lexbor, or bs4+lxml fallback) ----------
+RESULTS_ROOT_SEL = "main"
+# bs4 only: keep product/result subtrees; head, scripts, nav etc. never get built.
+# Has to admit every card shape in CHECKERS_CARD_SELECTORS / SIXTY60_CARD_SEL,
+# so it looks at data-component and itemprop as well as class.
+_STRAIN_RE = re.compile("product|search-results")
+_STRAIN_ATTRS = ("class", "data-component", "itemprop")
+
+def _strain(name, attrs) -> bool:
+    for a in _STRAIN_ATTRS:
+        v = attrs.get(a)
+        if v and _STRAIN_RE.search(v if isinstance(v, str) else " ".join(v)):
+            return True
+    return False
+
+_CARD_STRAINER = None if LexborHTMLParser else SoupStrainer(_strain)
+
+def _parse(html: str):
+    if LexborHTMLParser:
+        return LexborHTMLParser(html)
+    return BeautifulSoup(html, "lxml", parse_only=_CARD_STRAINER)
+
+def _select_cards(tree, sel) -> list:
+    """Query cards under <main> when there is one, else the whole tree.
+
+    bs4 trees are already strained down to product subtrees by _parse.
+    """
+    if LexborHTMLParser:
+        root = tree.css_first(RESULTS_ROOT_SEL)
+        if root is not None:
+            cards = root.css(sel)
+            if cards:
+                return cards
+    return _select(tree, sel)
+
+def _css(sel: str):
+    """Selector for _select/_select_one, compiled once up front on bs4.
+
+    Lexbor takes selector strings only, so there it is returned as-is.
+    """
+    return sel if LexborHTMLParser else sv.compile(sel)
+
+def _select(node, sel) -> list:
+    if LexborHTMLParser:
+        return node.css(sel)
+    return node.select(sel) if isinstance(sel, str) else sel.select(node)
+
+def _select_one(node, sel):
+    if LexborHTMLParser:
+        return node.css_first(sel)
+    return node.select_one(sel) if isinstance(sel, str) else sel.select_one(node)
+
+def _text(el, sep: str = " ") -> str:
+    if LexborHTMLParser:
+        return el.text(separator=sep, strip=True)
+    return el.get_text(sep, strip=True)
+
+def _attr(el, name: str) -> str | None:
+    return el.attributes.get(name) if LexborHTMLParser else el.get(name)
+
+def _tag(el) -> str:
+    return el.tag if LexborHTMLParser else el.name
+
+def _classes(el) -> str:
+    if LexborHTMLParser:
+        return el.attributes.get("class") or ""
+    return " ".join(el.get("class") or ())
+
+def _elements(el):
+    """Descendant elements of `el` in document order (not `el` itself)."""
+    if LexborHTMLParser:
+        it = el.traverse()
+        next(it, None)  # traverse() starts at el
+        return it
+    return el.find_all(True)
+
+_RAND_RE = re.compile(r"R\s*\d")
+
+def _own_texts(el):
+    """Yield each descendant text node in order, without serialising the subtree."""
+    if LexborHTMLParser:
+        # element.text(deep=False) would put a parent's text before its
+        # children's; walking the text nodes themselves keeps the order
+        for node in el.traverse(include_text=True):
+            if node.tag == "-text":
+                yield node.text(deep=False)
+    else:
+        yield from el.find_all(string=_RAND_RE)
+
+# rands and optional cents ("32.99", "32,99", "32^99") in one pass
+_PRICE_RE = re.compile(r"R?\s*([0-9]+)(?:[.,^]([0-9]{2}))?")
+# single or pack size ("500g", "6 x 330ml") in one pass
+_SIZE_RE = re.compile(r"\b((?:\d+\s*[x×]\s*)?\d+(?:\.\d+)?\s*(?:g|kg|ml|l|L))\b")
+_WORD_RE = re.compile(r"\w+")
 
 def _price_from_text(txt: str) -> float | None:
     if not txt:
         return None
-    m = re.search(r"R?\s*([0-9]+(?:[.,][0-9]{2})?)", txt)
-    return float(m.group(1).replace(",", ".")) if m else None
+    m = _PRICE_RE.search(txt)
+    if not m:
+        return None
+    rands, cents = m.groups()
+    return float(f"{rands}.{cents}") if cents else float(rands)
+
+def _card_price(card) -> float | None:
+    # first text node that looks like "R 12" – stops there instead of
+    # serialising the whole card
+    for txt in _own_texts(card):
+        m = _RAND_RE.search(txt) if txt else None
+        if m:
+            pr = _price_from_text(txt[m.start():])
+            if pr is not None:
+                return pr
+    return None
 
 def _size_guess(name: str) -> str:
-    m = re.search(r"\b(\d+(?:\.\d+)?\s*(?:g|kg|ml|l|L))\b", name or "")
+    m = _SIZE_RE.search(name or "")
     return m.group(1) if m else ""
 
+# every ASCII non-word char -> space, so split() matches _WORD_RE on ASCII
+_NONWORD_TABLE = str.maketrans({c: " " for c in map(chr, range(128))
+                                if not (c.isalnum() or c == "_")})
+
+@functools.lru_cache(maxsize=8192)
+def _tokens(s: str) -> frozenset[str]:
+    s = s.lower()
+    if s.isascii():
+        return frozenset(s.translate(_NONWORD_TABLE).split())
+    return frozenset(_WORD_RE.findall(s))
+
+class TokenTrie:
+    """Character trie over product-name tokens, each word leaf listing its hits.
+
+    Lets one walk per ingredient token count overlaps for every hit at once,
+    instead of intersecting the ingredient with each name separately.
+    """
+
+    _END = ""  # never a real character key
+
+    def __init__(self):
+        self._root: dict = {}
+
+    def insert(self, name: str, hit_id: int) -> None:
+        for tok in _tokens(name):
+            node = self._root
+            for ch in tok:
+                node = node.setdefault(ch, {})
+            node.setdefault(self._END, []).append(hit_id)
+
+    def overlap_score(self, ingredient_tokens) -> dict[int, int]:
+        counts: dict[int, int] = {}
+        for tok in ingredient_tokens:
+            node = self._root
+            for ch in tok:
+                node = node.get(ch)
+                if node is None:
+                    break
+            else:
+                for hit_id in node.get(self._END, ()):
+                    counts[hit_id] = counts.get(hit_id, 0) + 1
+        return counts
+
+TRIE_MIN_HITS = 16  # below this the per-hit set intersection is cheaper
+
 def _best_hit(ingredient: str, hits: list[dict]) -> dict | None:
     if not hits:
         return None
-    A = set(re.findall(r"\w+", ingredient.lower()))
-    def score(h):
-        B = set(re.findall(r"\w+", h["name"].lower()))
-        overlap = len(A & B) / max(1, len(A))
-        return (-overlap, h["price"])
-    return sorted(hits, key=score)[0]
+    best = _closest(ingredient, hits)
+    # only the winner's size is ever stored, so parse it once here
+    best["size"] = _size_guess(best["name"])
+    return best
+
+def _closest(ingredient: str, hits: list[dict]) -> dict:
+    A = _tokens(ingredient)
+    if not A:
+        # every overlap is 0, so it comes down to price
+        return min(hits, key=lambda h: h["price"])
+    n = len(A)
+    if len(hits) < TRIE_MIN_HITS:
+        def score(h):
+            overlap = len(A & _tokens(h["name"])) / n
+            return (-overlap, h["price"])
+        return min(hits, key=score)
+
+    trie = TokenTrie()
+    for i, h in enumerate(hits):
+        trie.insert(h["name"], i)
+    overlaps = trie.overlap_score(A)
+    i = min(range(len(hits)), key=lambda i: (-overlaps.get(i, 0) / n, hits[i]["price"]))
+    return hits[i]
+
+# ---------- shared page helpers ----------
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+              "AppleWebKit/537.36 (KHTML, like Gecko) "
+              "Chrome/124.0.0.0 Safari/537.36")
+BASE_CONTEXT = {
+    "viewport": {"width": 1366, "height": 900},
+    "locale": "en-ZA",
+    "user_agent": USER_AGENT,
+}
+
+# Counts the cards and scrolls whatever holds them in one round-trip: the
+# last card's nearest scrollable ancestor (SPA grids often sit in an inner
+# container that window.scrollBy would leave alone), else the page.
+_SCROLL_GRID_JS = """sel => {
+    const cards = document.querySelectorAll(sel);
+    let el = cards.length ? cards[cards.length - 1].parentElement : null;
+    while (el && !(el.scrollHeight > el.clientHeight
+                   && /auto|scroll/.test(getComputedStyle(el).overflowY))) {
+        el = el.parentElement;
+    }
+    (el || document.scrollingElement).scrollBy(0, 1200);
+    return cards.length;
+}"""
+
+async def _settle_and_scroll(page, card_sel: str) -> None:
+    # wait for the first card rather than a fixed sleep, then scroll only
+    # while lazy loading keeps adding cards
+    try:
+        # attached is enough: we read the DOM, not what's painted
+        await page.wait_for_selector(card_sel, state="attached", timeout=8000)
+    except PWTimeout:
+        return
+    for _ in range(5):
+        count = await page.evaluate(_SCROLL_GRID_JS, card_sel)
+        try:
+            await page.wait_for_function(
+                "([sel, n]) => document.querySelectorAll(sel).length > n",
+                arg=[card_sel, count], timeout=1500,
+            )
+        except PWTimeout:
+            break
+
+# ---------- session state (cookies/localStorage) ----------
+# Saved once per new context (after its first successful search, or right
+# after the consent click) and handed to every later context, so consent
+# banners and session bootstraps happen once, not per ingredient. Also
+# persisted to STATE_DIR for the next run.
+_STATE: dict[str, dict] = {}
+_consent_tried: set = set()  # contexts that already looked for a banner
+_state_saved: set = set()    # contexts whose session is already on disk
+_CHALLENGE_TITLES = ("Just a moment", "Attention Required")
+
+def _state_path(site: str) -> str:
+    return os.path.join(STATE_DIR, f"{site}.json")
+
+def _load_state(site: str) -> dict | None:
+    if site not in _STATE:
+        try:
+            with open(_state_path(site), encoding="utf-8") as f:
+                _STATE[site] = json.load(f)
+        except (OSError, ValueError):
+            return None
+    return _STATE[site]
+
+async def _save_state(ctx, site: str, force: bool = False) -> None:
+    # storage_state() + a file write per ingredient adds up; `force` is for
+    # the consent click, which changes the session mid-context
+    if ctx in _state_saved and not force:
+        return
+    _state_saved.add(ctx)
+    _STATE[site] = state = await ctx.storage_state()
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(_state_path(site), "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+async def _check_challenge(pool: BrowserPool, page, site: str) -> bool:
+    # a bot-challenge page means the session went stale; drop it and the
+    # pooled context carrying it so the next page starts clean
+    title = await page.title()
+    if not any(t in title for t in _CHALLENGE_TITLES):
+        return False
+    _STATE.pop(site, None)
+    # never write its stale session back or prime it again
+    _state_saved.add(page.context)
+    _consent_tried.add(page.context)
+    with contextlib.suppress(OSError):
+        os.remove(_state_path(site))
+    await pool.discard(page.context)
+    return True
+
+def _hit(name: str, price: float, url: str) -> dict:
+    return {
+        "name": " ".join(name.split()),
+        "price": price,
+        "size": "",  # filled in for the winner by _best_hit
+        "url": url,
+    }
+
+def _pick_from_html(extract, html: str, url: str, ingredient: str) -> dict | None:
+    # parse + card extraction + matching is all CPU; callers run this in a
+    # worker thread so other pages keep loading meanwhile
+    return _best_hit(ingredient, extract(_parse(html), url))
+
+# ---------- JSON search APIs (learned from the rendered pages' XHRs) ----------
+# Both sites hydrate their result grids from a JSON search call. The first
+# rendered search that sees one records its URL as a template; later
+# ingredients hit it directly over HTTP and only fall back to a browser
+# page if it errors or stops yielding products. A site whose API call fails
+# is not learned again for the rest of the run. The call is replayed with the
+# page's own request headers and the context's cookies, since results can
+# depend on the session (Sixty60's store follows location and consent).
+# site -> ((URL without query, query params, index of the one holding the
+#           term), request headers)
+_api_templates: dict[str, tuple[tuple[str, list[tuple[str, str]], int],
+                                dict[str, str]]] = {}
+_api_failed: set[str] = set()
+_http: httpx.AsyncClient | None = None
+
+_JSON_NAME_KEYS = ("name", "productName", "displayName", "title")
+_JSON_PRICE_KEYS = ("price", "currentPrice", "salePrice")
+# only inside a price object, e.g. {"price": {"formatted": "R19.99"}}; on
+# their own "value"/"amount" are just as often facet counts
+_JSON_PRICE_SUBKEYS = _JSON_PRICE_KEYS + ("amount", "value", "formatted")
+
+def _http_client() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            http2=True, timeout=15, follow_redirects=True,
+            headers={"User-Agent": USER_AGENT, "Accept": "application/json",
+                     "Accept-Language": "en-ZA,en;q=0.9"},
+        )
+    return _http
+
+def _json_price(v) -> float | None:
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, (int, float)):
+        return float(v)
+    if isinstance(v, str):
+        return _price_from_text(v)
+    if isinstance(v, dict):
+        for k in _JSON_PRICE_SUBKEYS:
+            if k in v and (p := _json_price(v[k])) is not None:
+                return p
+    return None
+
+def _hits_from_json(data, url: str, limit: int = 40) -> list[dict]:
+    # product-shaped objects anywhere in the payload: a name plus a price
+    hits, stack = [], [data]
+    while stack and len(hits) < limit:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+        elif isinstance(node, dict):
+            nm = next((node[k] for k in _JSON_NAME_KEYS
+                       if isinstance(node.get(k), str) and node[k].strip()), None)
+            pr = next((p for k in _JSON_PRICE_KEYS
+                       if k in node and (p := _json_price(node[k])) is not None), None)
+            if nm and pr is not None:
+                hits.append(_hit(nm, pr, url))
+            else:
+                stack.extend(reversed(list(node.values())))
+    return hits
+
+def _api_template(url: str, ingredient: str):
+    """Split `url` around the one query parameter whose value is the term."""
+    parts = urlsplit(url)
+    params = parse_qsl(parts.query, keep_blank_values=True)
+    idx = [i for i, (_, v) in enumerate(params) if v.strip().lower() == ingredient]
+    if len(idx) != 1:
+        return None
+    return parts._replace(query="", fragment="").geturl(), params, idx[0]
+
+def _api_url(template, ingredient: str) -> str:
+    base, params, idx = template
+    params = list(params)
+    params[idx] = (params[idx][0], ingredient)
+    return f"{base}?{urlencode(params)}"
+
+# transport headers; httpx sets its own (and can't decode every encoding)
+_REPLAY_SKIP_HEADERS = {"host", "content-length", "connection", "accept-encoding"}
+
+async def _replay_headers(resp, ctx) -> dict[str, str]:
+    """The learned call's request headers, cookies included."""
+    headers = {k: v for k, v in (await resp.request.all_headers()).items()
+               if not k.startswith(":") and k not in _REPLAY_SKIP_HEADERS}
+    if "cookie" not in headers:
+        cookies = await ctx.cookies(resp.url)
+        if cookies:
+            headers["cookie"] = "; ".join(f"{c['name']}={c['value']}" for c in cookies)
+    return headers
+
+def _sniff_search_api(page, site: str, ingredient: str) -> None:
+    async def on_response(resp):
+        if (site in _api_templates or site in _api_failed
+                or resp.request.method != "GET" or resp.status != 200):
+            return
+        template = _api_template(resp.url, ingredient)
+        if template is None:
+            return
+        if "json" not in (resp.headers.get("content-type") or ""):
+            return
+        try:
+            data = await resp.json()
+        except Exception:
+            return
+        if not _hits_from_json(data, resp.url):
+            return
+        headers = await _replay_headers(resp, page.context)
+        if site not in _api_failed:
+            _api_templates[site] = (template, headers)
+
+    page.on("response", on_response)
+
+async def _search_via_api(site: str, ingredient: str, page_url: str) -> dict | None:
+    if site not in _api_templates:
+        return None
+    template, headers = _api_templates[site]
+    try:
+        r = await _http_client().get(_api_url(template, ingredient), headers=headers)
+        r.raise_for_status()
+        hits = _hits_from_json(r.json(), page_url)
+    except (httpx.HTTPError, ValueError):
+        # blocked or schema changed: browser for the rest of the run
+        _api_templates.pop(site, None)
+        _api_failed.add(site)
+        return None
+    return _best_hit(ingredient, hits)
 
 # ---------- checkers.co.za ----------
-async def search_checkers_site(pw, ingredient: str) -> dict | None:
+# Broad product tile selectors used on checkers web
+CHECKERS_CARD_SELECTORS = [
+    "[class*='product-list__item']",
+    "[data-component='product-tile']",
+    "[class*='product-grid__item']",
+    "div.product, li.product",
+]
+CHECKERS_CARD_UNION = ", ".join(CHECKERS_CARD_SELECTORS)
+# name/price stay ordered lists: earlier selectors win within a card
+CHECKERS_NAME_SELECTORS = [
+    "[class*='item-name']",
+    "[class*='product__name']",
+    "[class*='product-title']",
+    "[itemprop='name']",
+    "img[alt]",
+]
+CHECKERS_PRICE_SELECTORS = [
+    "[class*='price']", ".price", ".now",
+]
+CHECKERS_CARD_MATCHER = _css(CHECKERS_CARD_UNION)
+CHECKERS_NAME_MATCHERS = [_css(s) for s in CHECKERS_NAME_SELECTORS]
+CHECKERS_PRICE_MATCHERS = [_css(s) for s in CHECKERS_PRICE_SELECTORS]
+
+def _checkers_hits(tree, url: str) -> list[dict]:
+    # one pass over the tree; a union returns each node once
+    cards = _select_cards(tree, CHECKERS_CARD_MATCHER)[:40]
+
+    hits = []
+    for c in cards:
+        # name
+        nm = None
+        for ns in CHECKERS_NAME_MATCHERS:
+            el = _select_one(c, ns)
+            if el:
+                nm = _attr(el, "alt") if _tag(el) == "img" else _text(el)
+                if nm:
+                    break
+        if not nm:
+            continue
+
+        # price
+        pr = None
+        for ps in CHECKERS_PRICE_MATCHERS:
+            el = _select_one(c, ps)
+            if el:
+                pr = _price_from_text(_text(el))
+                if pr is not None:
+                    break
+        if pr is None:
+            pr = _card_price(c)
+        if pr is None:
+            continue
+
+        hits.append(_hit(nm, pr, url))
+    return hits
+
+# Checkers search pages are often server-rendered, so a plain GET can carry
+# the cards. Cleared the first time a page comes back without any, after
+# which every search goes straight to the browser.
+_checkers_static = True
+
+async def _fetch_static(url: str) -> str | None:
+    try:
+        r = await _http_client().get(url, headers={"Accept": "text/html"})
+    except httpx.HTTPError:
+        return None
+    return r.text if r.status_code == 200 else None
+
+async def search_checkers_site(pool: BrowserPool, ingredient: str) -> dict | None:
+    global _checkers_static
+    q = quote_plus(ingredient)
     # try both ?search= and ?Search=
     urls = [
-        f"https://www.checkers.co.za/search/all?q={ingredient.replace(' ', '%20')}",
-        f"https://www.checkers.co.za/search?search={ingredient.replace(' ', '%20')}",
-        f"https://www.checkers.co.za/search?Search={ingredient.replace(' ', '%20')}",
+        f"https://www.checkers.co.za/search/all?q={q}",
+        f"https://www.checkers.co.za/search?search={q}",
+        f"https://www.checkers.co.za/search?Search={q}",
     ]
-    browser = await pw.chromium.launch(headless=True)
-    ctx = await browser.new_context(
-        viewport={"width": 1366, "height": 900},
-        locale="en-ZA",
-        user_agent=("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/124.0.0.0 Safari/537.36"),
-    )
-    page = await ctx.new_page()
-    try:
-        for url in urls:
-            try:
-                await page.goto(url, wait_until="domcontentloaded", timeout=60000)
-            except Exception:
-                continue
-
-            # small soft waits + light scroll to let lazy content render
-            await page.wait_for_timeout(1500)
-            for _ in range(5):
-                await page.mouse.wheel(0, 1200)
-                await page.wait_for_timeout(1200)
-
-            html = await page.content()
-            soup = BeautifulSoup(html, "lxml")
-
-            # Broad product tile selectors used on checkers web
-            card_sel = [
-                "[class*='product-list__item']",
-                "[data-component='product-tile']",
-                "[class*='product-grid__item']",
-                "div.product, li.product",
-            ]
-            name_sel = [
-                "[class*='item-name']",
-                "[class*='product__name']",
-                "[class*='product-title']",
-                "[itemprop='name']",
-                "img[alt]",
-            ]
-            price_sel = [
-                "[class*='price']", ".price", ".now",
-            ]
-
-            cards = []
-            for s in card_sel:
-                cards.extend(soup.select(s))
-            # de-dupe while preserving order
-            cards = list(dict.fromkeys(cards))[:40]
-
-            hits = []
-            for c in cards:
-                # name
-                nm = None
-                for ns in name_sel:
-                    el = c.select_one(ns)
-                    if el:
-                        nm = el.get("alt") if el.name == "img" else el.get_text(" ", strip=True)
-                        if nm:
-                            break
-                if not nm:
+    best = await _search_via_api("checkers", ingredient, urls[0])
+    if best:
+        return best
+    if _checkers_static:
+        html = await _fetch_static(urls[0])
+        best = (await asyncio.to_thread(_pick_from_html, _checkers_hits, html,
+                                        urls[0], ingredient)
+                if html else None)
+        if best:
+            return best
+        _checkers_static = False
+    # a challenge page drops the stale context; one more go in a fresh one
+    for _ in range(2):
+        async with pool.page("checkers", setup=_setup_context, **BASE_CONTEXT,
+                             storage_state=_load_state("checkers")) as page:
+            _sniff_search_api(page, "checkers", ingredient)
+            for url in urls:
+                try:
+                    await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+                except Exception:
                     continue
+                if await _check_challenge(pool, page, "checkers"):
+                    break
 
-                # price
-                pr = None
-                for ps in price_sel:
-                    el = c.select_one(ps)
-                    if el:
-                        pr = _price_from_text(el.get_text(" ", strip=True))
-                        if pr is not None:
-                            break
-                if pr is None:
-                    pr = _price_from_text(c.get_text(" ", strip=True))
-                if pr is None:
-                    continue
+                await _settle_and_scroll(page, CHECKERS_CARD_UNION)
 
-                hits.append({
-                    "name": nm.strip(),
-                    "price": pr,
-                    "size": _size_guess(nm),
-                    "url": url,
-                })
+                html = await page.content()
+                best = await asyncio.to_thread(_pick_from_html, _checkers_hits, html,
+                                               url, ingredient)
+                if best:
+                    await _save_state(page.context, "checkers")
+                    return best
+            else:
+                return None
+    return None
 
-            best = _best_hit(ingredient, hits)
-            if best:
-                return best
+# ---------- sixty60.co.za ----------
+# Sixty60 module class names – use contains()
+SIXTY60_CARD_SEL = 'div[class*="product-card_container"]'
+SIXTY60_CARD_MATCHER = _css(SIXTY60_CARD_SEL)
+SIXTY60_NAME_CLASS = "product-card_product-name"
+SIXTY60_FULL_CLASS = "price-display_full"
+SIXTY60_HALF_CLASS = "price-display_half"
 
-        return None
-    finally:
-        await ctx.close()
-        await browser.close()
+def _sixty60_card(c) -> tuple[str | None, float | None]:
+    # one walk over the card picks up what used to be four select_one calls:
+    # first name-class node, first img[alt], first full/half price spans
+    nm_el = img = full = half = None
+    for node in _elements(c):
+        cls = _classes(node)
+        if nm_el is None and SIXTY60_NAME_CLASS in cls:
+            nm_el = node
+        if full is None and SIXTY60_FULL_CLASS in cls:
+            full = node
+        if half is None and SIXTY60_HALF_CLASS in cls:
+            half = node
+        if img is None and _tag(node) == "img" and _attr(node, "alt") is not None:
+            img = node
+        if nm_el is not None and img is not None and full is not None and half is not None:
+            break
 
-# ---------- sixty60.co.za ----------
-async def search_sixty60(pw, ingredient: str) -> dict | None:
+    # name
+    nm = _text(nm_el) if nm_el is not None else None
+    if not nm and img is not None:
+        nm = _attr(img, "alt")
+    if not nm:
+        return None, None
+
+    # price — full + half spans or any text containing ‘R’
+    # cents sit in their own span; join with "^" so "R32" + "99" isn't R3299
+    txt = _text(full, "") if full is not None else ""
+    if txt and half is not None:
+        cents = _text(half, "").lstrip(".,")
+        if cents:
+            # the separator may sit on either side: "R32." + "99" or "R32" + ".99"
+            txt = txt.rstrip(".,") + "^" + cents
+    return nm, _price_from_text(txt) or _card_price(c)
+
+def _sixty60_hits(tree, url: str) -> list[dict]:
+    hits = []
+    for c in _select_cards(tree, SIXTY60_CARD_MATCHER)[:40]:
+        nm, pr = _sixty60_card(c)
+        if nm and pr is not None:
+            hits.append(_hit(nm, pr, url))
+    return hits
+
+async def search_sixty60(pool: BrowserPool, ingredient: str) -> dict | None:
+    q = quote_plus(ingredient)
     urls = [
-        f"https://www.sixty60.co.za/search?search={ingredient.replace(' ', '%20')}",
-        f"https://www.sixty60.co.za/search?Search={ingredient.replace(' ', '%20')}",
+        f"https://www.sixty60.co.za/search?search={q}",
+        f"https://www.sixty60.co.za/search?Search={q}",
     ]
-    browser = await pw.chromium.launch(headless=True)
-    ctx = await browser.new_context(
-        viewport={"width": 1366, "height": 900},
-        locale="en-ZA",
-        timezone_id="Africa/Johannesburg",
-        geolocation={"latitude": -33.9249, "longitude": 18.4241},  # Cape Town
-        permissions=["geolocation"],
-        user_agent=("Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/124.0.0.0 Safari/537.36"),
-        extra_http_headers={"Accept-Language": "en-ZA,en;q=0.9"},
-    )
-    page = await ctx.new_page()
-    try:
-        for url in urls:
-            try:
-                await page.goto(url, wait_until="domcontentloaded", timeout=60000)
-            except Exception:
-                continue
-
-            # Dismiss cookie banners if present (best-effort)
-            for sel in [
-                "button:has-text('Accept')", "button:has-text('ACCEPT')",
-                "button[aria-label*='Accept']"
-            ]:
+    best = await _search_via_api("sixty60", ingredient, urls[0])
+    if best:
+        return best
+    # a challenge page drops the stale context; one more go in a fresh one
+    for _ in range(2):
+        async with pool.page(
+            "sixty60", setup=_setup_context,
+            **BASE_CONTEXT,
+            timezone_id="Africa/Johannesburg",
+            geolocation={"latitude": -33.9249, "longitude": 18.4241},  # Cape Town
+            permissions=["geolocation"],
+            extra_http_headers={"Accept-Language": "en-ZA,en;q=0.9"},
+            storage_state=_load_state("sixty60"),
+        ) as page:
+            _sniff_search_api(page, "sixty60", ingredient)
+            for url in urls:
                 try:
-                    await page.locator(sel).first.click(timeout=800)
-                    break
+                    await page.goto(url, wait_until="domcontentloaded", timeout=60000)
                 except Exception:
-                    pass
-
-            # soft waits + light scroll
-            await page.wait_for_timeout(1500)
-            for _ in range(5):
-                await page.mouse.wheel(0, 1200)
-                await page.wait_for_timeout(1200)
-
-            html = await page.content()
-            soup = BeautifulSoup(html, "lxml")
-
-            # Sixty60 module class names – use contains()
-            cards = soup.select('div[class*="product-card_container"]')
-            hits = []
-            for c in cards[:40]:
-                # name
-                nm_el = c.select_one('[class*="product-card_product-name"]')
-                nm = nm_el.get_text(" ", strip=True) if nm_el else None
-                if not nm:
-                    img = c.select_one("img[alt]")
-                    if img and img.get("alt"):
-                        nm = img["alt"]
-                if not nm:
                     continue
+                if await _check_challenge(pool, page, "sixty60"):
+                    break
 
-                # price — full + half spans or any text containing ‘R’
-                full = c.select_one('[class*="price-display_full"]')
-                half = c.select_one('[class*="price-display_half"]')
-                txt = ""
-                if full: txt += full.get_text(strip=True)
-                if half: txt += half.get_text(strip=True)
-                pr = _price_from_text(txt) or _price_from_text(c.get_text(" ", strip=True))
-                if pr is None:
-                    continue
+                # Dismiss cookie banners if present (best-effort); once per
+                # context, since a live consent cookie carries over within one
+                if page.context not in _consent_tried:
+                    _consent_tried.add(page.context)
+                    for sel in [
+                        "button:has-text('Accept')", "button:has-text('ACCEPT')",
+                        "button[aria-label*='Accept']"
+                    ]:
+                        try:
+                            await page.locator(sel).first.click(timeout=800)
+                        except Exception:
+                            continue
+                        # persist consent now, even if this search finds nothing
+                        await _save_state(page.context, "sixty60", force=True)
+                        break
 
-                hits.append({
-                    "name": nm.strip(),
-                    "price": pr,
-                    "size": _size_guess(nm),
-                    "url": url,
-                })
+                await _settle_and_scroll(page, SIXTY60_CARD_SEL)
 
-            best = _best_hit(ingredient, hits)
-            if best:
-                return best
+                html = await page.content()
+                best = await asyncio.to_thread(_pick_from_html, _sixty60_hits, html,
+                                               url, ingredient)
+                if best:
+                    await _save_state(page.context, "sixty60")
+                    return best
+            else:
+                return None
+    return None
 
-        return None
+SEARCHERS = {
+    "CHECKERS": search_checkers_site,
+    "SIXTY60": search_sixty60,
+}
+# ---------- firestore ----------
+@functools.lru_cache(maxsize=1)
+def fs() -> firestore.Client:
+    return firestore.Client()
+
+BATCH_SIZE = 450  # Firestore caps a WriteBatch at 500 ops
+WRITE_CONCURRENCY = 50  # commits in flight; returns flatten past ~40
+
+@functools.lru_cache(maxsize=None)
+def _items_col(db, region: str, store: str):
+    # one CollectionReference per (region, store) for the whole run
+    return (db.collection("prices").document(region)
+              .collection("stores").document(store)
+              .collection("items"))
+
+def _item_ref(db, region: str, store: str, ingredient: str):
+    return _items_col(db, region, store).document(ingredient.lower())
+
+def flush_batch(db, items: list[tuple[str, str, str, dict]]) -> None:
+    """Commit (region, store, ingredient, best) writes as one WriteBatch."""
+    batch = db.batch()
+    for region, store, ingredient, best in items:
+        batch.set(_item_ref(db, region, store, ingredient),
+                  {**best, "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+    batch.commit()
+
+def fresh_in_firestore(db, store: str, ingredients: list[str]) -> set[str]:
+    """Ingredients whose docs in every region were updated within the TTL.
+
+    One get_all() round-trip; covers runners that start with an empty
+    local cache.
+    """
+    refs = {(r, i): _item_ref(db, r, store, i) for i in ingredients for r in REGIONS}
+    if not refs:
+        return set()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=CACHE_TTL_S)
+    fresh = set()
+    for snap in db.get_all(list(refs.values())):
+        ts = (snap.to_dict() or {}).get("updatedAt") if snap.exists else None
+        if ts is not None and ts >= cutoff:
+            fresh.add(snap.reference.path)
+    return {i for i in ingredients
+            if all(refs[(r, i)].path in fresh for r in REGIONS)}
+
+def _digest(best: dict) -> str:
+    return hashlib.sha1(json.dumps(best, sort_keys=True).encode()).hexdigest()
+
+# ---------- driver ----------
+class _Pacer:
+    """Token bucket of one: spaces request starts at least `interval` s apart."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+async def scrape_store(store: str, pool: BrowserPool, db, cache,
+                       pending: list, written: list) -> None:
+    """Scrape every ingredient for one store, queueing writes onto `pending`.
+
+    `cache` maps (store, ingredient) -> best hit for CACHE_TTL_S, plus a
+    digest of what was last written per region so unchanged docs aren't
+    rewritten; `written` collects those digests until the commit succeeds.
+    """
+    search = SEARCHERS[store]
+    sem = asyncio.Semaphore(CONCURRENCY)
+    # SCRAPER_CONCURRENCY already bounds load on the site; only pace on request
+    pacer = _Pacer(PAUSE_MS / 1000) if PAUSE_MS > 0 else None
+
+    # docs another run refreshed recently; nothing to scrape or write
+    uncached = [i for i in INGREDIENTS if f"{store}:{i}" not in cache]
+    fresh = set()
+    if uncached and not FORCE_REFRESH:
+        try:
+            fresh = await asyncio.to_thread(fresh_in_firestore, db, store, uncached)
+        except Exception as e:  # only a shortcut; scrape everything instead
+            print(f"[{store}] freshness check failed: {e!r}")
+
+    async def scrape_one(ingredient: str) -> dict | None:
+        key = f"{store}:{ingredient}"
+        if ingredient in fresh:
+            print(f"[{store}] {ingredient!r} is fresh in Firestore, skipping")
+            return None
+        best = None if FORCE_REFRESH else cache.get(key)
+        if best is None:
+            async with sem:
+                if pacer is not None:
+                    await pacer.wait()
+                best = await search(pool, ingredient)
+            if not best:
+                print(f"[{store}] no match for {ingredient!r}")
+                return None
+            cache.set(key, best, expire=CACHE_TTL_S)
+        digest = _digest(best)
+        for region in REGIONS:
+            wkey = f"{key}:{region}:written"
+            if not FORCE_REFRESH and cache.get(wkey) == digest:
+                continue
+            pending.append((region, store, ingredient, best))
+            written.append((wkey, digest))
+        print(f"[{store}] {ingredient!r} -> {best['name']} R{best['price']:.2f}")
+        return best
+
+    results = await asyncio.gather(
+        *(scrape_one(ing) for ing in INGREDIENTS), return_exceptions=True
+    )
+    for ing, res in zip(INGREDIENTS, results):
+        if isinstance(res, Exception):
+            print(f"[{store}] {ing!r} failed: {res!r}")
+
+async def run():
+    global _http
+    # fail before any scraping, not after the earlier stores' writes are queued
+    if unknown := [s for s in STORES if s not in SEARCHERS]:
+        raise ValueError(f"unknown STORE {', '.join(unknown)}; "
+                         f"expected one of {', '.join(SEARCHERS)}")
+    # one Firestore client, browser pool, HTTP client and cache for all stores
+    db = fs()
+    cache = diskcache.Cache(CACHE_DIR)
+    pending: list[tuple[str, str, str, dict]] = []
+    written: list[tuple[str, str]] = []
+
+    try:
+        async with async_playwright() as pw:
+            pool = BrowserPool()
+            try:
+                await pool.init(pw, min=POOL_MIN, max=POOL_MAX, idle_timeout=POOL_IDLE_S,
+                                max_pages=POOL_PAGES)
+                for store in STORES:
+                    await scrape_store(store, pool, db, cache, pending, written)
+            finally:
+                await pool.drain()
+                if _http is not None:
+                    await _http.aclose()
+                    _http = None  # a later run() gets a fresh client
+        # batches touch disjoint docs, so commit them side by side; each commit
+        # is a blocking RPC, so it runs in a worker thread
+        write_sem = asyncio.Semaphore(WRITE_CONCURRENCY)
+
+        async def commit(chunk):
+            async with write_sem:
+                await asyncio.to_thread(flush_batch, db, chunk)
+
+        await asyncio.gather(*(commit(pending[i:i + BATCH_SIZE])
+                               for i in range(0, len(pending), BATCH_SIZE)))
+        # only remember writes once the commits above have gone through
+        for wkey, digest in written:
+            cache.set(wkey, digest, expire=CACHE_TTL_S)
     finally:
-        await ctx.close()
-        await browser.close()
+        cache.close()
 
+if __name__ == "__main__":
+    asyncio.run(run())